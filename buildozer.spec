@@ -28,7 +28,7 @@ android.permissions = BLUETOOTH,BLUETOOTH_ADMIN,BLUETOOTH_CONNECT,BLUETOOTH_SCAN
 
 # (list) Application requirements
 # Core dependencies + Bluetooth, Graph, Pandas
-requirements = python3,kivy==2.3.0,kivymd,pyjnius,plyer,pandas,pyserial,kivy_garden.graph,matplotlib
+requirements = python3,kivy==2.3.0,kivymd,pyjnius,plyer,pyserial,kivy_garden.graph,matplotlib
 
 # (str) Custom source folders for garden
 garden_requirements = graph
@@ -19,8 +19,13 @@ from kivymd.uix.dialog import MDDialog
 from kivymd.uix.button import MDFlatButton, MDRaisedButton
 from kivymd.uix.list import OneLineListItem
 from kivymd.uix.snackbar import Snackbar
+from kivymd.uix.filemanager import MDFileManager
 
-import os, csv, io, time, queue, threading, traceback
+import os, csv, time, queue, threading, traceback
+
+from safergas_data import (BulkReceiver, BULK_PARTIAL, LOG_COLUMNS, TIME_FMT, RETENTION_DAYS,
+                           compact_log, migrate_log_header, last_entry, import_archives,
+                           parse_in_subprocess, write_sd_log)
 
 # Graph
 from kivy_garden.graph import Graph, MeshLinePlot
@@ -38,9 +43,13 @@ else:
 
 APP_NAME = "Safer Gas"
 LOG_CSV = "safergas_logs.csv"
+AGG_CSV = "safergas_logs_agg.csv"  # downsampled readings older than the retention window
 EVENT_LOG = "safergas_events.txt"
 STORE_FILE = "safergas_settings.json"
 AUTO_UPDATE_INTERVAL = 900  # seconds = 15 minutes (change 600-1200 allowed)
+COMPACT_INTERVAL = 3600  # seconds between background compaction passes
+RETENTION_CHOICES = [7, 30, 90, 0]  # days of raw readings to keep, 0 = keep everything
+BULK_NEGOTIATE_TIMEOUT = 2.0  # seconds to wait for BULK_BEGIN before falling back to text UPLOAD_SD
 
 KV = '''
 MDScreen:
@@ -191,7 +200,9 @@ class CommManager:
                     else:
                         time.sleep(0.05)
                 except Exception:
-                    time.sleep(0.05)
+                    if not self.running:
+                        break
+                    raise  # read failure means the link dropped; report it below
         except Exception as e:
             self.rx_queue.put(f"BT_ERROR:{e}")
             self.connected = False
@@ -230,20 +241,24 @@ class CommManager:
         try:
             is_ = self.sock.getInputStream()
             buf = bytearray(1024)
+            pending = b""  # partial line carried over between reads (bulk frames span reads)
             while self.running:
                 try:
                     available = is_.available()
                     if available > 0:
                         read = is_.read(buf, 0, min(available, 1024))
-                        data = bytes(buf[:read]).decode('utf-8', errors='ignore')
-                        for line in data.splitlines():
-                            line = line.strip()
+                        pending += bytes(buf[:read])
+                        *lines, pending = pending.split(b"\n")
+                        for line in lines:
+                            line = line.decode('utf-8', errors='ignore').strip()
                             if line:
                                 self.rx_queue.put(line)
                     else:
                         time.sleep(0.05)
                 except Exception:
-                    time.sleep(0.05)
+                    if not self.running:
+                        break
+                    raise  # read failure means the link dropped; report it below
         except Exception as e:
             self.rx_queue.put(f"BT_ERROR:{e}")
             self.connected = False
@@ -295,11 +310,21 @@ class SaferGasApp(MDApp):
         self.comm = CommManager(self.rxq, self)
         self.store = None
         self.log_path = None
+        self.agg_path = None
+        self.log_lock = threading.Lock()  # guards appends/rewrites of the reading log (never taken on the UI thread)
+        self._log_q = queue.Queue()  # readings waiting for the log writer thread
+        self._next_entry = 1
+        self._compacting = False
+        self._importing = False
         self.event_log = None
         self.graph_plot = None
         self.latest = {"weight": 0.0, "gasv": 0.0, "status": "OK"}
         self._incoming_mode = False
         self._incoming_buf = []
+        self.bulk = None
+        self._upload_started = threading.Event()
+        self._upload_lock = threading.Lock()
+        self._upload_mode = None  # "bulk" / "text" once the device answered or we fell back
         self.tips = [
             "Always turn off your gas regulator after cooking.",
             "Check your gas hose for cracks or aging every two weeks.",
@@ -319,14 +344,19 @@ class SaferGasApp(MDApp):
         self.root = Builder.load_string(KV)
         self.store = JsonStore(os.path.join(self.user_data_dir, STORE_FILE))
         self.log_path = os.path.join(self.user_data_dir, LOG_CSV)
+        self.agg_path = os.path.join(self.user_data_dir, AGG_CSV)
         self.event_log = os.path.join(self.user_data_dir, EVENT_LOG)
         os.makedirs(self.user_data_dir, exist_ok=True)
         if not os.path.exists(self.log_path):
             with open(self.log_path, "w", newline="") as f:
                 writer = csv.writer(f)
-                writer.writerow(["Entry", "Weight(kg)", "GasV", "Status"])
+                writer.writerow(LOG_COLUMNS)
+        migrate_log_header(self.log_path)
+        self._next_entry = last_entry(self.log_path) + 1
+        threading.Thread(target=self._log_writer, daemon=True).start()
         if not os.path.exists(self.event_log):
             open(self.event_log, "a").close()
+        self.bulk = BulkReceiver(os.path.join(self.user_data_dir, BULK_PARTIAL))
         # init graph
         g = self.root.ids.graph
         self.graph_plot = MeshLinePlot(color=[0, 1, 0, 1])
@@ -336,6 +366,9 @@ class SaferGasApp(MDApp):
         self.tip_of_day = self._get_tip_of_day()
         # schedule queue processing
         Clock.schedule_interval(self.process_rx_queue, 0.2)
+        # background retention/compaction of the reading log
+        Clock.schedule_once(lambda dt: self._start_compaction(), 30)
+        Clock.schedule_interval(lambda dt: self._start_compaction(), COMPACT_INTERVAL)
         # request android perms
         if ANDROID:
             try:
@@ -407,8 +440,7 @@ class SaferGasApp(MDApp):
         # request SD upload and an immediate latest; schedule periodic updates
         try:
             if self.comm.connected:
-                self._append_event("Requesting SD upload...")
-                self.comm.send_line("UPLOAD_SD")
+                self._request_sd_upload()
                 time.sleep(0.2)
                 self.comm.send_line("GET_LATEST")
                 # schedule periodic auto updates
@@ -416,6 +448,26 @@ class SaferGasApp(MDApp):
         except Exception as e:
             self._append_event(f"Connected worker error: {e}")
 
+    def _request_sd_upload(self):
+        # try checksummed bulk mode first (resuming a dropped transfer); old firmware stays on text mode
+        self._upload_started.clear()
+        with self._upload_lock:
+            self._upload_mode = None
+        req = self.bulk.resume_request()
+        self._append_event(f"Requesting SD upload (bulk): {req}")
+        self.comm.send_line(req)
+        if not self._upload_started.wait(BULK_NEGOTIATE_TIMEOUT) and self._claim_upload("text"):
+            self._append_event("No bulk reply, requesting SD upload (text)")
+            self.comm.send_line("UPLOAD_SD")
+
+    def _claim_upload(self, mode):
+        # first of bulk reply / text fallback wins, so only one SD transfer rewrites the log
+        with self._upload_lock:
+            if self._upload_mode in (None, mode):
+                self._upload_mode = mode
+                return True
+            return False
+
     def _auto_get_latest(self):
         try:
             if self.comm.connected:
@@ -427,6 +479,7 @@ class SaferGasApp(MDApp):
     def disconnect_device(self):
         try:
             self.comm.disconnect()
+            self._pause_bulk()
             self._append_event("Disconnected by user")
             Snackbar(text="Disconnected").open()
         except Exception as e:
@@ -462,6 +515,9 @@ class SaferGasApp(MDApp):
 
     def _handle_line(self, line):
         try:
+            if line.startswith("BULK"):
+                self._handle_bulk_line(line)
+                return
             self._append_event(f"RX: {line}")
             if line.startswith("REQUEST_TARE:"):
                 try:
@@ -481,6 +537,8 @@ class SaferGasApp(MDApp):
                         self._append_event("LATEST parse error")
                 return
             if line == "BEGIN_LOG":
+                self._claim_upload("text")
+                self._upload_started.set()
                 self._incoming_mode = True
                 self._incoming_buf = []
                 return
@@ -496,11 +554,65 @@ class SaferGasApp(MDApp):
                 Snackbar(text="Tare set on device").open()
                 return
             if line.startswith("BT_ERROR:"):
+                self._pause_bulk()
                 self._append_event("BT_ERROR: " + line.split(":", 1)[1])
                 Snackbar(text="Bluetooth error").open()
         except Exception as e:
             self._append_event("Handle line exception: " + str(e))
 
+    def _handle_bulk_line(self, line):
+        try:
+            want = None
+            if line.startswith("BULK_BEGIN,"):
+                self._append_event(f"RX: {line}")
+                try:
+                    BulkReceiver.parse_begin(line)
+                except ValueError as e:
+                    # don't claim the upload: the text fallback still goes out after the timeout
+                    self._append_event(f"Bulk reply rejected: {e}")
+                    return
+                if not self._claim_upload("bulk"):
+                    # text fallback already requested; don't run a second transfer
+                    self._append_event("Late BULK_BEGIN ignored, text upload in progress")
+                    threading.Thread(target=lambda: self.comm.send_line("BULK_CANCEL"), daemon=True).start()
+                    return
+                self._upload_started.set()
+                want = self.bulk.begin(line)
+            elif line.startswith("BULK,"):
+                want = self.bulk.frame(line)
+            elif line.startswith("BULK_END,"):
+                self._append_event(f"RX: {line}")
+                try:
+                    text = self.bulk.end(line)
+                except ValueError as e:
+                    self._append_event(f"Bulk transfer failed: {e}")
+                    want = self.bulk.next_seq if self.bulk.active else None
+                else:
+                    lines = text.splitlines()
+                    self._append_event(f"Bulk transfer complete: {len(lines)} lines")
+                    threading.Thread(target=self._save_incoming_log, args=(lines,), daemon=True).start()
+            if want is not None:
+                self._append_event(f"Bulk chunk {want} bad or missing, resuming")
+                threading.Thread(target=lambda: self.comm.send_line(f"BULK_RESUME,{want}"), daemon=True).start()
+        except Exception as e:
+            self._append_event("Bulk line error: " + str(e))
+
+    def _pause_bulk(self):
+        # keep verified chunks on disk so the next UPLOAD_SD_BULK resumes after a dropout
+        try:
+            if self.bulk and self.bulk.active:
+                self.bulk.save_partial()
+                self._append_event(f"Bulk transfer paused at chunk {self.bulk.next_seq}")
+        except Exception as e:
+            self._append_event("Bulk pause error: " + str(e))
+
+    def on_pause(self):
+        self._pause_bulk()
+        return True
+
+    def on_stop(self):
+        self._pause_bulk()
+
     def _open_device_tare_confirm(self, val):
         txt = f"Device requests: set tare to {val:.2f} kg. Confirm?"
         yes = MDFlatButton(text="YES", on_release=lambda *a: self._on_device_tare_confirm(True))
@@ -524,14 +636,8 @@ class SaferGasApp(MDApp):
     # ---------------- add reading & plot ----------------
     def _add_reading(self, weight, gasv, status):
         try:
-            # append to CSV safely
-            entry_idx = 1
-            if os.path.exists(self.log_path):
-                with open(self.log_path, "r", encoding="utf-8") as f:
-                    entry_idx = sum(1 for _ in f)
-            with open(self.log_path, "a", newline="", encoding="utf-8") as f:
-                w = csv.writer(f)
-                w.writerow([entry_idx, f"{weight:.2f}", f"{gasv:.3f}", status])
+            # append to CSV on the writer thread, compaction/SD saves may hold the lock
+            self._log_q.put([f"{weight:.2f}", f"{gasv:.3f}", status, time.strftime(TIME_FMT), "app"])
             # update latest and UI
             self.latest = {"weight": weight, "gasv": gasv, "status": status}
             self._update_ui()
@@ -540,6 +646,21 @@ class SaferGasApp(MDApp):
         except Exception as e:
             self._append_event("Add reading error: " + str(e))
 
+    def _log_writer(self):
+        while True:
+            rows = [self._log_q.get()]
+            while not self._log_q.empty():
+                rows.append(self._log_q.get_nowait())
+            try:
+                with self.log_lock:
+                    with open(self.log_path, "a", newline="", encoding="utf-8") as f:
+                        w = csv.writer(f)
+                        for r in rows:
+                            w.writerow([self._next_entry] + r)
+                            self._next_entry += 1
+            except Exception as e:
+                self._append_event("Log writer error: " + str(e))
+
     def _append_graph_point(self, weight):
         try:
             g = self.root.ids.graph
@@ -554,38 +675,27 @@ class SaferGasApp(MDApp):
 
     def _save_incoming_log(self, lines):
         try:
-            csv_text = "\n".join(lines)
-            df = None
-            try:
-                import pandas as pd
-                df = pd.read_csv(io.StringIO(csv_text))
-                df.to_csv(self.log_path, index=False)
-                self._append_event(f"Saved {len(df)} rows from SD")
-                # rebuild graph
-                weights = []
-                if 'Weight(kg)' in df.columns:
-                    weights = df['Weight(kg)'].astype(float).tolist()
-                else:
-                    weights = df.iloc[:, 1].astype(float).tolist()
-                pts = [(i, float(weights[i])) for i in range(len(weights))]
-                self.graph_plot.points = pts
-                g = self.root.ids.graph
-                g.xmax = max(10, len(pts))
-                g.ymax = max(max(weights) + 1, 1) if weights else 10
-            except Exception:
-                # fallback to csv module parsing
-                rdr = csv.reader(io.StringIO(csv_text))
-                rows = list(rdr)
-                if rows and rows[0] and rows[0][0].lower().startswith("entry"):
-                    # write raw rows
-                    with open(self.log_path, "w", newline="", encoding="utf-8") as f:
-                        w = csv.writer(f)
-                        for r in rows:
-                            w.writerow(r)
-                    self._append_event(f"Saved {len(rows)-1} rows from SD (fallback)")
+            rows = list(csv.reader(lines))
+            if not (rows and rows[0] and rows[0][0].lower().startswith("entry")):
+                self._append_event(f"SD log not saved: missing header ({len(rows)} rows dropped)")
+                return
+            with self.log_lock:
+                res = write_sd_log(self.log_path, self.agg_path, rows)
+                self._next_entry = max(self._next_entry, res["max_entry"] + 1)
+            self._append_event(f"Merged SD log: {res['added']} new rows, {res['rows']} total ({res['stamped']} stamped, "
+                               f"{res['aggregated']} already aggregated, {res['bad']} bad)")
+            self._rebuild_graph(res["weights"])
         except Exception as e:
             self._append_event("Save incoming log error: " + str(e))
 
+    @mainthread
+    def _rebuild_graph(self, weights):
+        pts = [(i, float(weights[i])) for i in range(len(weights))]
+        self.graph_plot.points = pts
+        g = self.root.ids.graph
+        g.xmax = max(10, len(pts))
+        g.ymax = max(max(weights) + 1, 1) if weights else 10
+
     def _update_ui(self):
         try:
             weight = self.latest.get("weight", 0.0)
@@ -629,11 +739,13 @@ class SaferGasApp(MDApp):
         view_logs = MDFlatButton(text="View Data Log", on_release=lambda *a: self._view_data_log())
         view_events = MDFlatButton(text="View Event Log", on_release=lambda *a: self._view_event_log())
         delete_logs = MDFlatButton(text="Delete Logs", on_release=lambda *a: self._confirm_delete_logs())
+        retention = MDFlatButton(text="Retention", on_release=lambda *a: self._open_retention())
+        import_btn = MDFlatButton(text="Import Archives", on_release=lambda *a: self._open_import())
         theme_toggle = MDFlatButton(text="Toggle Theme", on_release=lambda *a: self._toggle_theme())
         clear_tare = MDFlatButton(text="Clear Tare", on_release=lambda *a: self._clear_tare())
         close = MDFlatButton(text="Close", on_release=lambda *a: self._close_settings())
         self.settings_dialog = MDDialog(title="Settings", text="Choose action", size_hint=(0.9, 0.8),
-                                        buttons=[view_logs, view_events, delete_logs, theme_toggle, clear_tare, close])
+                                        buttons=[view_logs, view_events, delete_logs, retention, import_btn, theme_toggle, clear_tare, close])
         self.settings_dialog.open()
 
     def _view_data_log(self):
@@ -668,15 +780,186 @@ class SaferGasApp(MDApp):
             if hasattr(self, "del_dialog") and self.del_dialog:
                 self.del_dialog.dismiss()
             if confirmed:
-                with open(self.log_path, "w", newline="", encoding="utf-8") as f:
-                    writer = csv.writer(f)
-                    writer.writerow(["Entry", "Weight(kg)", "GasV", "Status"])
-                open(self.event_log, "w", encoding="utf-8").close()
-                self._append_event("Logs cleared by user")
+                # log_lock may be held by compaction; clear on a worker, not the UI thread
+                threading.Thread(target=self._clear_logs, daemon=True).start()
                 Snackbar(text="Logs deleted").open()
         except Exception as e:
             self._append_event("_delete_logs_confirmed error: " + str(e))
 
+    def _clear_logs(self):
+        try:
+            with self.log_lock:
+                with open(self.log_path, "w", newline="", encoding="utf-8") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(LOG_COLUMNS)
+                if os.path.exists(self.agg_path):
+                    os.remove(self.agg_path)
+                self._next_entry = 1
+            open(self.event_log, "w", encoding="utf-8").close()
+            self._append_event("Logs cleared by user")
+        except Exception as e:
+            self._append_event("_clear_logs error: " + str(e))
+
+    # ---------------- retention / compaction ----------------
+    def _retention_days(self):
+        try:
+            return int(self.store.get("retention")["days"])
+        except Exception:
+            return RETENTION_DAYS
+
+    def _start_compaction(self):
+        # runs on the UI thread; the worker never touches the JsonStore
+        days = self._retention_days()
+        if self._compacting or days <= 0:
+            return
+        self._compacting = True
+        threading.Thread(target=self._compaction_worker, args=(days,), daemon=True).start()
+
+    def _compaction_worker(self, days):
+        try:
+            res = compact_log(self.log_path, self.agg_path, days, lock=self.log_lock)
+            if res:
+                self._save_compaction_stats(res, time.strftime(TIME_FMT))
+                self._append_event(f"Compacted {res['folded']} readings into {res['buckets']} aggregates, "
+                                   f"saved {res['saved']} B in {res['seconds']:.2f} s")
+                if res["more"]:
+                    # keep passes short; continue with the next batch shortly
+                    Clock.schedule_once(lambda dt: self._start_compaction(), 5)
+        except Exception as e:
+            self._append_event("Compaction error: " + str(e))
+        finally:
+            self._compacting = False
+
+    @mainthread
+    def _save_compaction_stats(self, res, when):
+        # JsonStore isn't thread safe; settings are only written from the UI thread
+        try:
+            stats = self.store.get("compaction") if self.store.exists("compaction") else {}
+            self.store.put("compaction", last_saved=res["saved"], last_seconds=res["seconds"],
+                           last_rows=res["folded"], last_run=when,
+                           total_saved=stats.get("total_saved", 0) + res["saved"])
+        except Exception as e:
+            self._append_event("Compaction stats error: " + str(e))
+
+    def _retention_text(self):
+        days = self._retention_days()
+        txt = f"Keep raw readings: {'all' if days <= 0 else f'{days} days'}\n"
+        txt += "Older readings are kept as hourly averages.\n"
+        if self.store.exists("compaction"):
+            c = self.store.get("compaction")
+            txt += (f"Last compaction: {c['last_run']}, {c['last_rows']} readings in {c['last_seconds']:.2f} s\n"
+                    f"Space saved: {c['last_saved'] / 1024:.1f} KB (total {c['total_saved'] / 1024:.1f} KB)")
+        else:
+            txt += "No compaction yet"
+        return txt
+
+    def _open_retention(self):
+        try:
+            self.settings_dialog.dismiss()
+            buttons = [MDFlatButton(text=("Off" if d <= 0 else f"{d} d"), on_release=lambda *a, d=d: self._set_retention(d))
+                       for d in RETENTION_CHOICES]
+            buttons.append(MDFlatButton(text="Compact now", on_release=lambda *a: self._compact_now()))
+            buttons.append(MDFlatButton(text="Close", on_release=lambda *a: self.ret_dialog.dismiss()))
+            self.ret_dialog = MDDialog(title="Retention", text=self._retention_text(), size_hint=(0.9, None), buttons=buttons)
+            self.ret_dialog.open()
+        except Exception as e:
+            self._append_event("_open_retention error: " + str(e))
+
+    def _set_retention(self, days):
+        try:
+            self.store.put("retention", days=days)
+            self._append_event(f"Retention set to {days} days")
+            self.ret_dialog.text = self._retention_text()
+        except Exception as e:
+            self._append_event("_set_retention error: " + str(e))
+
+    def _compact_now(self):
+        try:
+            self.ret_dialog.dismiss()
+            if self._compacting:
+                Snackbar(text="Compaction already running").open()
+            elif self._retention_days() <= 0:
+                Snackbar(text="Retention is off").open()
+            else:
+                self._start_compaction()
+                Snackbar(text="Compaction started").open()
+        except Exception as e:
+            self._append_event("_compact_now error: " + str(e))
+
+    # ---------------- archive import ----------------
+    def _open_import(self):
+        try:
+            self.settings_dialog.dismiss()
+            if self._importing:
+                Snackbar(text="Import already running").open()
+                return
+            self.file_manager = MDFileManager(exit_manager=lambda *a: self.file_manager.close(),
+                                              select_path=self._on_import_selected, selector="folder")
+            start = "/storage/emulated/0" if ANDROID else os.path.expanduser("~")
+            self.file_manager.show(start)
+        except Exception as e:
+            self._append_event("_open_import error: " + str(e))
+
+    def _on_import_selected(self, path):
+        try:
+            self.file_manager.close()
+            self._importing = True
+            self._append_event(f"Importing archives from {path}")
+            self.import_dialog = MDDialog(title="Import Archives", text="Scanning...", size_hint=(0.9, None))
+            self.import_dialog.open()
+            threading.Thread(target=self._import_worker, args=(path,), daemon=True).start()
+        except Exception as e:
+            self._importing = False
+            self._append_event("_on_import_selected error: " + str(e))
+
+    def _import_worker(self, path):
+        try:
+            def progress(done, total, src, rows, bad, err):
+                self._import_progress(f"Parsed {done}/{total}: {os.path.basename(src)}")
+                if err:
+                    self._append_event(f"Import skipped {src}: {err}")
+            # desktop: parse pool runs in a separate interpreter; Android has no usable
+            # multiprocessing, so parse in this thread
+            parser = None if ANDROID else parse_in_subprocess
+            stats, weights = import_archives(path, self.log_path, self.agg_path, workers=1 if ANDROID else None,
+                                             lock=self.log_lock, progress=progress, parser=parser,
+                                             committed=lambda n: setattr(self, "_next_entry", n + 1))
+            self._append_event(f"Imported {stats['files']} files: {stats['readings']} readings, "
+                               f"{stats['duplicates']} duplicates, {stats['bad_rows']} bad rows in {stats['seconds']:.1f} s")
+            self._import_done(stats, weights)
+        except Exception as e:
+            self._append_event("Import error: " + str(e))
+            self._import_progress(f"Import failed: {e}", done=True)
+        finally:
+            self._importing = False
+
+    @mainthread
+    def _import_progress(self, txt, done=False):
+        if getattr(self, "import_dialog", None):
+            self.import_dialog.text = txt
+            if done:
+                self.import_dialog.dismiss()
+                Snackbar(text=txt).open()
+
+    @mainthread
+    def _import_done(self, stats, weights):
+        try:
+            self.store.put("usage", **{k: v for k, v in stats.items() if k != "errors"})
+            self._rebuild_graph(weights)
+            self.import_dialog.dismiss()
+            per_day = f"{stats['kg_per_day']} kg/day" if stats["kg_per_day"] is not None else "n/a"
+            txt = (f"Files: {stats['files']} ({len(stats['errors'])} skipped)\n"
+                   f"Readings: {stats['readings']} ({stats['duplicates']} duplicates, {stats['bad_rows']} bad rows)\n"
+                   f"Period: {stats['first'] or '-'} to {stats['last'] or '-'}\n"
+                   f"Gas used: {stats['consumed_kg']} kg, {per_day}, {stats['refills']} refills\n"
+                   f"Leak readings: {stats['leak_readings']}\n"
+                   f"Not imported (hour already aggregated): {stats['skipped_aggregated']}\n"
+                   f"Took {stats['seconds']:.1f} s")
+            dlg = MDDialog(title="Import complete", text=txt, size_hint=(0.9, None), buttons=[MDFlatButton(text="Close", on_release=lambda *a: dlg.dismiss())])
+            dlg.open()
+        except Exception as e:
+            self._append_event("_import_done error: " + str(e))
+
     def _toggle_theme(self):
         try:
             # schedule to avoid layout conflicts
@@ -0,0 +1,889 @@
+# Safer Gas App - data helpers (no Kivy imports, safe for CLI and worker processes)
+# Author: Chinedu Ifediora (IMAXEUNO)
+
+import os, sys, io, csv, json, time, zlib, base64, argparse
+
+LOG_HEADER = ["Entry", "Weight(kg)", "GasV", "Status"]
+
+# ---------------- Bulk SD transfer ----------------
+# Line based so it survives the existing SPP/serial readers:
+#   app    -> UPLOAD_SD_BULK,<codecs>,<session|->,<next_seq>
+#   device -> BULK_BEGIN,<session>,<codec>,<total_chunks>,<start_seq>
+#   device -> BULK,<seq>,<crc32 hex>,<base64 payload>      (one per chunk)
+#   device -> BULK_END,<total_chunks>,<crc32 hex of whole text>
+#   app    -> BULK_RESUME,<seq>   (bad/missing chunk, device restarts from seq)
+#   app    -> BULK_CANCEL         (bulk reply came after the app fell back to UPLOAD_SD)
+# The session id must be cheap (e.g. SD file size + mtime) so BULK_BEGIN goes out
+# at once; the whole-file CRC is only needed for BULK_END, after streaming.
+# Every chunk is compressed on its own so a transfer can resume from any chunk.
+# Devices that don't know UPLOAD_SD_BULK keep using BEGIN_LOG/END_LOG text mode.
+BULK_CODECS = ("zlib", "raw")
+BULK_CHUNK_LINES = 64
+BULK_PARTIAL = "safergas_bulk_partial.jsonl"
+BULK_SAVE_EVERY = 16  # accepted chunks between partial checkpoints on disk
+
+
+def bulk_crc(data):
+    return format(zlib.crc32(data) & 0xFFFFFFFF, "08x")
+
+
+def bulk_pack(raw, codec):
+    if codec == "zlib":
+        return zlib.compress(raw, 9)
+    if codec == "raw":
+        return raw
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def bulk_unpack(data, codec):
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "raw":
+        return data
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def bulk_encode(text, codec="zlib", chunk_lines=BULK_CHUNK_LINES, start_seq=0, session=None):
+    # device side of the protocol; used by the benchmark and for testing firmware
+    lines = text.splitlines()
+    chunks = ["\n".join(lines[i:i + chunk_lines]) + "\n" for i in range(0, len(lines), chunk_lines)]
+    raw_all = "".join(chunks).encode("utf-8")
+    if session is None:
+        session = format(len(raw_all), "x")
+    out = [f"BULK_BEGIN,{session},{codec},{len(chunks)},{start_seq}"]
+    for seq in range(start_seq, len(chunks)):
+        payload = bulk_pack(chunks[seq].encode("utf-8"), codec)
+        out.append(f"BULK,{seq},{bulk_crc(payload)},{base64.b64encode(payload).decode('ascii')}")
+    out.append(f"BULK_END,{len(chunks)},{bulk_crc(raw_all)}")
+    return out
+
+
+class BulkReceiver:
+    # App side: collects verified chunks, remembers them across dropouts.
+    def __init__(self, partial_path=None):
+        self.partial_path = partial_path
+        self.session = None
+        self.codec = None
+        self.total = 0
+        self.chunks = []
+        self.active = False
+        self.resume_sent = None
+        self._saved = 0  # chunks already in the partial file
+        self.load_partial()
+
+    @property
+    def next_seq(self):
+        return len(self.chunks)
+
+    def resume_request(self, codecs=BULK_CODECS):
+        return f"UPLOAD_SD_BULK,{'|'.join(codecs)},{self.session or '-'},{self.next_seq}"
+
+    @staticmethod
+    def parse_begin(line):
+        # (session, codec, total, start); raises ValueError on a malformed BULK_BEGIN
+        parts = line.split(",")
+        try:
+            session, codec, total = parts[1], parts[2], int(parts[3])
+            start = int(parts[4]) if len(parts) > 4 else 0
+        except (IndexError, ValueError):
+            raise ValueError(f"Malformed {line!r}")
+        if not session or codec not in BULK_CODECS or total < 0 or start < 0:
+            raise ValueError(f"Unsupported {line!r}")
+        return session, codec, total, start
+
+    def begin(self, line):
+        # returns None when the stream lines up, else the seq to ask for
+        session, codec, total, start = self.parse_begin(line)
+        if session != self.session:
+            self.chunks = []
+            self._saved = 0
+        self.session, self.codec, self.total = session, codec, total
+        self.active = True
+        self.resume_sent = None
+        if start != self.next_seq:
+            return self._want()
+        return None
+
+    def frame(self, line):
+        # returns None if accepted/ignored, else the seq to ask for again
+        if not self.active:
+            return None
+        try:
+            _, seq, crc, b64 = line.split(",", 3)
+            seq = int(seq)
+        except ValueError:
+            return self._want()
+        if seq < self.next_seq:
+            return None  # duplicate after a resend
+        if seq > self.next_seq:
+            return self._want()
+        try:
+            payload = base64.b64decode(b64, validate=True)
+            if bulk_crc(payload) != crc.lower():
+                return self._want()
+            self.chunks.append(bulk_unpack(payload, self.codec).decode("utf-8"))
+        except Exception:
+            return self._want()
+        self.resume_sent = None
+        if self.next_seq % BULK_SAVE_EVERY == 0:
+            self.checkpoint()
+        return None
+
+    def end(self, line):
+        # returns the full text; raises ValueError (still active) if chunks are missing or corrupt
+        parts = line.split(",")
+        total, crc = int(parts[1]), parts[2].lower()
+        if self.next_seq < total:
+            raise ValueError(f"Missing chunks {self.next_seq}/{total}")
+        text = "".join(self.chunks)
+        if bulk_crc(text.encode("utf-8")) != crc:
+            self.chunks = []  # start over from chunk 0, same session
+            self._saved = 0
+            self.resume_sent = None
+            raise ValueError("Whole-file CRC mismatch")
+        self.reset()
+        return text
+
+    def _want(self):
+        if self.resume_sent == self.next_seq:
+            return None  # already asked, wait for the device
+        self.resume_sent = self.next_seq
+        return self.next_seq
+
+    def reset(self):
+        self.session, self.codec, self.total, self.chunks = None, None, 0, []
+        self.active = False
+        self.resume_sent = None
+        self._saved = 0
+        if self.partial_path and os.path.exists(self.partial_path):
+            try:
+                os.remove(self.partial_path)
+            except OSError:
+                pass
+
+    def save_partial(self):
+        # dropout / app pause: keep the chunks and wait for the next UPLOAD_SD_BULK
+        self.active = False
+        self.resume_sent = None
+        self.checkpoint()
+
+    def checkpoint(self):
+        # partial file is JSON lines: a header, then one chunk per line, appended as they arrive
+        if not self.partial_path or not self.chunks:
+            return
+        if self._saved == 0:
+            tmp = self.partial_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"session": self.session, "codec": self.codec, "total": self.total}) + "\n")
+                f.writelines(json.dumps(c) + "\n" for c in self.chunks)
+            os.replace(tmp, self.partial_path)
+        else:
+            with open(self.partial_path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(c) + "\n" for c in self.chunks[self._saved:])
+                f.flush()
+                os.fsync(f.fileno())
+        self._saved = len(self.chunks)
+
+    def load_partial(self):
+        if not self.partial_path or not os.path.exists(self.partial_path):
+            return
+        try:
+            with open(self.partial_path, "r", encoding="utf-8") as f:
+                d = json.loads(f.readline())
+                chunks = []
+                for line in f:
+                    try:
+                        chunks.append(json.loads(line))
+                    except ValueError:
+                        break  # torn last line after a crash
+            self.session, self.codec, self.total, self.chunks = d["session"], d["codec"], d["total"], chunks
+            self._saved = 0  # rewrite without the torn line on the next checkpoint
+        except Exception:
+            self.session, self.codec, self.total, self.chunks = None, None, 0, []
+
+
+# ---------------- Retention / compaction ----------------
+# Raw readings newer than the retention window stay in the log; older ones are
+# folded into per-bucket aggregates in a side file. "Last" is the newest raw
+# time already aggregated, so a crash between the two file swaps can't count
+# readings twice. SD rows come back on every upload: "LastEntry"/"LastKey" are the
+# newest folded SD row, and an SD dump that still holds that exact row is the same
+# device log, so its rows up to LastEntry are already folded. A wiped or replaced
+# device log won't match and nothing is skipped. Only whole buckets are folded,
+# so each bucket is one row.
+LOG_COLUMNS = LOG_HEADER + ["Time", "Source"]  # Source: sd / app / import
+AGG_HEADER = ["Time", "Samples", "Weight(kg)", "WeightMin", "WeightMax", "GasV", "Status", "Last",
+              "LastEntry", "LastKey"]
+AGG_LAST = AGG_HEADER.index("Last")
+TIME_FMT = "%Y-%m-%d %H:%M:%S"
+RETENTION_DAYS = 30
+AGG_BUCKET = 3600  # seconds per aggregate row
+COMPACT_MAX_ROWS = 20000  # expired rows folded per pass; the rest wait for the next pass
+STATUS_RANK = {"OK": 0, "LOW": 1, "LEAK": 2}
+
+
+class _NoLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def parse_time(s):
+    try:
+        return time.mktime(time.strptime(s.strip(), TIME_FMT))
+    except (ValueError, AttributeError):
+        return None
+
+
+def _replace_text(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def migrate_log_header(path):
+    # older logs (and SD dumps) lack Time/Source; rows keep their fields, only the header grows
+    if not os.path.exists(path):
+        return False
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        first = f.readline()
+        if [c.strip() for c in first.split(",")] not in (LOG_HEADER, LOG_HEADER + ["Time"]):
+            return False
+        rest = f.read()
+    _replace_text(path, ",".join(LOG_COLUMNS) + "\r\n" + rest)
+    return True
+
+
+def last_entry(path):
+    # Entry number of the last row, read from the file tail
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 4096))
+            tail = f.read().decode("utf-8", errors="ignore")
+        for line in reversed(tail.splitlines()):
+            field = line.split(",", 1)[0].strip()
+            if field.isdigit():
+                return int(field)
+            if field:
+                return 0
+    except OSError:
+        pass
+    return 0
+
+
+def _read_agg(agg_path):
+    if not os.path.exists(agg_path):
+        return []
+    with open(agg_path, "r", encoding="utf-8", newline="") as f:
+        return [row for row in csv.reader(f) if len(row) > AGG_LAST and row[0] != AGG_HEADER[0]]
+
+
+def _agg_high_water(agg_rows):
+    times = [t for t in (parse_time(row[AGG_LAST]) for row in agg_rows) if t is not None]
+    return max(times) if times else None
+
+
+def _agg_anchor(agg_rows):
+    # (entry, key) of the newest folded SD row, or None
+    anchors = [(int(row[AGG_LAST + 1]), row[AGG_LAST + 2]) for row in agg_rows
+               if len(row) > AGG_LAST + 2 and row[AGG_LAST + 1].isdigit() and row[AGG_LAST + 2]]
+    return max(anchors) if anchors else None
+
+
+def _key_text(key):
+    return f"{key[1]:.2f}|{key[2]:.3f}|{key[3]}"
+
+
+def _fold(buckets, bucket, t, weight, gasv, status, anchor=None):
+    b = buckets.setdefault(int(t // bucket) * bucket, [0, 0.0, weight, weight, 0.0, "OK", t, (0, "")])
+    b[0] += 1
+    b[1] += weight
+    b[2] = min(b[2], weight)
+    b[3] = max(b[3], weight)
+    b[4] += gasv
+    if STATUS_RANK.get(status, 0) > STATUS_RANK.get(b[5], 0):
+        b[5] = status
+    b[6] = max(b[6], t)
+    if anchor and anchor > b[7]:
+        b[7] = anchor
+
+
+def _bucket_rows(buckets):
+    rows = []
+    for start in sorted(buckets):
+        n, wsum, wmin, wmax, gsum, st, last, (entry, key) = buckets[start]
+        rows.append([time.strftime(TIME_FMT, time.localtime(start)), n, f"{wsum / n:.2f}",
+                     f"{wmin:.2f}", f"{wmax:.2f}", f"{gsum / n:.3f}", st,
+                     time.strftime(TIME_FMT, time.localtime(last)), entry or "", key])
+    return rows
+
+
+def _agg_text(old_rows, new_rows):
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(AGG_HEADER)
+    w.writerows(sorted(old_rows + new_rows, key=lambda r: (parse_time(r[0]) or 0, r[AGG_LAST])))
+    return out.getvalue()
+
+
+def _write_agg(agg_path, old_rows, new_rows):
+    _replace_text(agg_path, _agg_text(old_rows, new_rows))
+
+
+def write_sd_log(path, agg_path, rows, now=None):
+    # Merges an SD dump (the device's whole log, without times) into the log; rows that
+    # are not on the SD card (imported archives, app readings) stay. Dump rows already
+    # in the log keep their Time, rows already folded into the aggregates (same device
+    # log as the aggregate anchor) are skipped, the rest are stamped with the receive
+    # time. Returns stats plus the weights for the graph.
+    now = now or time.time()
+    stamp = time.strftime(TIME_FMT, time.localtime(now))
+    existing, index = [], {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            rdr = csv.reader(f)
+            next(rdr, None)
+            for r in rdr:
+                if not r:
+                    continue
+                r = (r + [""] * len(LOG_COLUMNS))[:len(LOG_COLUMNS)]
+                existing.append(r)
+                key = _sd_key(r)
+                if key:
+                    index.setdefault(key, r)
+    anchor = _agg_anchor(_read_agg(agg_path)) if agg_path else None
+    parsed, bad = [], 0
+    for r in rows[1:]:
+        key = _sd_key(r)
+        if key is None:
+            bad += 1 if any(c.strip() for c in r) else 0
+            continue
+        parsed.append((key, r[4].strip() if len(r) > 4 and parse_time(r[4]) is not None else None))
+    folded_entry = 0
+    if anchor and any(k[0] == anchor[0] and _key_text(k) == anchor[1] for k, _ in parsed):
+        folded_entry = anchor[0]
+    added, stamped, skipped = [], 0, 0
+    for key, ts in parsed:
+        old = index.get(key)
+        if old is not None:
+            if parse_time(old[4]) is None:
+                old[4] = ts or stamp  # legacy untimed row, now it has a time
+                stamped += 1
+            continue
+        if ts is None and key[0] <= folded_entry:
+            skipped += 1
+            continue
+        row = [key[0], f"{key[1]:.2f}", f"{key[2]:.3f}", key[3], ts or stamp, "sd"]
+        index[key] = row
+        added.append(row)
+        stamped += ts is None
+    out_rows = existing + added
+    out_rows.sort(key=lambda r: parse_time(r[4]) or 0)  # stable: keeps SD order within the same time
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(LOG_COLUMNS)
+    w.writerows(out_rows)
+    _replace_text(path, out.getvalue())
+    weights, max_entry = [], 0
+    for r in out_rows:
+        try:
+            weights.append(float(r[1]))
+            max_entry = max(max_entry, int(r[0]))
+        except ValueError:
+            pass
+    return {"rows": len(out_rows), "added": len(added), "max_entry": max_entry, "stamped": stamped, "aggregated": skipped,
+            "bad": bad, "weights": weights}
+
+
+def _sd_key(row):
+    try:
+        return int(row[0]), round(float(row[1]), 2), round(float(row[2]), 3), row[3].strip()
+    except (ValueError, IndexError):
+        return None
+
+
+def compact_log(path, agg_path, retention_days=RETENTION_DAYS, bucket=AGG_BUCKET, lock=None,
+                max_rows=COMPACT_MAX_ROWS, now=None):
+    # Returns stats dict, or None when nothing has expired. Rows are read only up to the
+    # first one still inside the window (or the per-pass cap); the rest of the file is
+    # copied as bytes. Only the final swap holds `lock`, and it copies rows appended
+    # meanwhile into the new file.
+    lock = lock or _NoLock()
+    t0 = time.perf_counter()
+    # whole buckets only, so an hour is never split across passes
+    cutoff = int(((now or time.time()) - retention_days * 86400) // bucket) * bucket
+    with lock:
+        end = os.path.getsize(path)
+    old_agg = _read_agg(agg_path)
+    hw = _agg_high_water(old_agg)
+
+    buckets = {}
+    folded = dropped = 0
+    more = False
+    kept = []  # untimed rows ahead of the stop point
+    with open(path, "rb") as f:
+        header = f.readline()
+        stop = f.tell()
+        cur = None
+        while stop < end:
+            line = f.readline()
+            if not line:
+                break
+            row = next(csv.reader([line.decode("utf-8", errors="ignore")]), [])
+            t = parse_time(row[4]) if len(row) > 4 else None
+            if t is None:
+                kept.append(line)
+                stop = f.tell()
+                continue
+            if t >= cutoff:
+                break  # rows are time ordered: the rest is inside the window
+            b = int(t // bucket) * bucket
+            if folded + dropped >= max_rows and b != cur:
+                more = True
+                break
+            cur = b
+            stop = f.tell()
+            if hw is not None and t <= hw:
+                dropped += 1  # already in the aggregates
+                continue
+            key = _sd_key(row)
+            if key is None:
+                dropped += 1
+                continue
+            folded += 1
+            anchor = (key[0], _key_text(key)) if len(row) > 5 and row[5].strip() == "sd" else None
+            _fold(buckets, bucket, t, key[1], key[2], key[3], anchor)
+        if not (folded or dropped):
+            return None
+        tail_start = stop
+        tmp = path + ".compact"
+        with open(tmp, "wb") as out:
+            out.write(header)
+            out.writelines(kept)
+            f.seek(tail_start)
+            left = end - tail_start
+            while left > 0:
+                block = f.read(min(left, 1 << 16))
+                if not block:
+                    break
+                out.write(block)
+                left -= len(block)
+            out.flush()
+            os.fsync(out.fileno())
+        f.seek(max(0, end - 256))
+        check = f.read(min(end, 256))
+
+    agg_rows = _bucket_rows(buckets)
+    if agg_rows:
+        _replace_text(agg_path + ".next", _agg_text(old_agg, agg_rows))
+
+    with lock:
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            f.seek(max(0, end - 256))
+            if size < end or f.read(min(end, 256)) != check:
+                for p in (tmp, agg_path + ".next"):
+                    if os.path.exists(p):
+                        os.remove(p)
+                return None  # log was rewritten (SD upload / delete) while we worked
+            appended = f.read()
+        before = size + (os.path.getsize(agg_path) if os.path.exists(agg_path) else 0)
+        if appended:
+            with open(tmp, "ab") as out:
+                out.write(appended)
+                out.flush()
+                os.fsync(out.fileno())
+        if agg_rows:
+            os.replace(agg_path + ".next", agg_path)
+        os.replace(tmp, path)
+        after = os.path.getsize(path) + (os.path.getsize(agg_path) if os.path.exists(agg_path) else 0)
+    return {"folded": folded, "dropped": dropped, "buckets": len(agg_rows), "more": more,
+            "bytes_before": before, "bytes_after": after, "saved": before - after,
+            "seconds": time.perf_counter() - t0}
+
+
+# ---------------- Archive import ----------------
+# Old safergas_logs.csv exports and SD dumps are parsed in a process pool, merged
+# into one deduplicated, time ordered log and the derived data (graph series,
+# usage statistics) is rebuilt in a single pass over the result. Rows without a
+# Time column can't be placed in time; they go first, in file order.
+IMPORT_EXTS = (".csv", ".txt")
+GRAPH_MAX_POINTS = 2000
+
+
+def find_archives(src):
+    if os.path.isfile(src):
+        return [src]
+    found = []
+    for root, _, files in os.walk(src):
+        for name in sorted(files):
+            if name.lower().endswith(IMPORT_EXTS) and not name.lower().endswith("_agg.csv"):
+                found.append(os.path.join(root, name))
+    return sorted(found)
+
+
+def _parse_rows(lines, source="import"):
+    # rows are (t or None, time str, entry, weight, gasv, status, source); returns (rows, bad)
+    rows, bad = [], 0
+    for row in csv.reader(lines):
+        if not row:
+            continue
+        try:
+            entry = int(row[0])
+            weight, gasv = float(row[1]), float(row[2])
+            status = row[3].strip()
+            if status not in STATUS_RANK:
+                raise ValueError(status)
+        except (ValueError, IndexError):
+            bad += 1
+            continue
+        ts = row[4].strip() if len(row) > 4 else ""
+        t = parse_time(ts) if ts else None
+        if ts and t is None:
+            bad += 1
+            continue
+        src = row[5].strip() if len(row) > 5 and row[5].strip() else source
+        rows.append((t, ts, entry, round(weight, 2), round(gasv, 3), status, src))
+    return rows, bad
+
+
+def parse_archive(path):
+    # worker: returns (path, rows, bad, error); any per-file failure goes in error
+    try:
+        with open(path, "r", encoding="utf-8", errors="ignore", newline="") as f:
+            rdr = csv.reader(f)
+            header = [c.strip() for c in next(rdr, [])]
+            if header[:len(LOG_HEADER)] != LOG_HEADER:
+                return path, [], 0, "not a Safer Gas log"
+            rows, bad = _parse_rows(f)
+    except Exception as e:  # csv.Error on stray text files, OSError, ...
+        return path, [], 0, str(e) or type(e).__name__
+    return path, rows, bad, None
+
+
+def _parse_log_bytes(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8", errors="ignore")
+    lines = text.splitlines()
+    return _parse_rows(lines[1:] if start == 0 else lines, source="")
+
+
+def _read_tail(path, end, n=256):
+    # last n bytes before `end`, used to tell an appended log from a rewritten one
+    if not end:
+        return b""
+    with open(path, "rb") as f:
+        f.seek(max(0, end - n))
+        return f.read(min(end, n))
+
+
+def _parse_all(paths, workers, progress):
+    results = []
+    pool = None
+    if workers != 1 and len(paths) > 1:
+        try:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # never fork: the caller may have threads running. Children re-import __main__,
+            # so from the app go through parse_in_subprocess instead.
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        except (ImportError, OSError, NotImplementedError, ValueError):
+            pool = None  # e.g. Android has no sem_open; parse in this process
+    try:
+        it = pool.map(parse_archive, paths, chunksize=max(1, len(paths) // (4 * (workers or os.cpu_count() or 1)))) \
+            if pool else map(parse_archive, paths)
+        for i, res in enumerate(it, 1):
+            results.append(res)
+            if progress:
+                progress(i, len(paths), res[0], len(res[1]), res[2], res[3])
+    finally:
+        if pool:
+            pool.shutdown()
+    return results
+
+
+def parse_in_subprocess(paths, workers, progress):
+    # App side: run the pool from a fresh, Kivy-free interpreter (the "parse" command)
+    # so worker processes never start from the app process.
+    import subprocess, tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        src, out = os.path.join(tmp, "paths.json"), os.path.join(tmp, "rows.json")
+        with open(src, "w", encoding="utf-8") as f:
+            json.dump(paths, f)
+        cmd = [sys.executable, os.path.abspath(__file__), "parse", src, out]
+        if workers:
+            cmd += ["--workers", str(workers)]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+        for line in proc.stdout:
+            if progress:
+                d = json.loads(line)
+                progress(d["done"], d["total"], d["path"], d["rows"], d["bad"], d["error"])
+        if proc.wait() != 0:
+            raise RuntimeError(f"archive parser exited with {proc.returncode}")
+        with open(out, "r", encoding="utf-8") as f:
+            return [(p, [tuple(r) for r in rows], bad, err) for p, rows, bad, err in json.load(f)]
+
+
+def usage_stats(rows, max_points=GRAPH_MAX_POINTS):
+    # one pass over merged rows: graph series (every step-th weight) plus consumption/refill/leak counts
+    step = max(1, -(-len(rows) // max_points))
+    weights = []
+    consumed = 0.0
+    refills = leaks = lows = 0
+    prev = None
+    for i, r in enumerate(rows):
+        w = r[3]
+        if i % step == 0:
+            weights.append(w)
+        if prev is not None:
+            if w < prev:
+                consumed += prev - w
+            elif w - prev > 1.0:
+                refills += 1
+        prev = w
+        if r[5] == "LEAK":
+            leaks += 1
+        elif r[5] == "LOW":
+            lows += 1
+    timed = [r[0] for r in rows if r[0] is not None]
+    days = (timed[-1] - timed[0]) / 86400 if len(timed) > 1 else 0
+    return {"readings": len(rows), "consumed_kg": round(consumed, 2), "refills": refills,
+            "leak_readings": leaks, "low_readings": lows, "days": round(days, 1),
+            "kg_per_day": round(consumed / days, 3) if days >= 1 else None,
+            "first": time.strftime(TIME_FMT, time.localtime(timed[0])) if timed else None,
+            "last": time.strftime(TIME_FMT, time.localtime(timed[-1])) if timed else None}, weights
+
+
+def _merge_rows(rows, seen, untimed, timed):
+    for r in rows:
+        key = r[1:6] if r[0] is None else (r[1],) + r[3:6]
+        if key in seen:
+            continue
+        seen.add(key)
+        (untimed if r[0] is None else timed).append(r)
+
+
+def import_archives(src, log_path, agg_path=None, workers=None, lock=None, progress=None, bucket=AGG_BUCKET,
+                    parser=None, committed=None):
+    # Merges every archive under src (plus the current log) into log_path.
+    # Readings older than the aggregate high-water mark are folded into aggregates
+    # instead, skipping hours the aggregates already cover. Rows appended to the log
+    # while archives are parsed are picked up under `lock` before the rewrite.
+    # Rows keep their Entry and Source so SD uploads still recognise them;
+    # committed(max_entry) is called before the lock is released.
+    lock = lock or _NoLock()
+    t0 = time.perf_counter()
+    paths = [p for p in find_archives(src) if os.path.abspath(p) != os.path.abspath(log_path)]
+    with lock:
+        log_end = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+        log_tail = _read_tail(log_path, log_end)
+    results = (parser or _parse_all)(paths, workers, progress)
+    log_rows, log_bad = _parse_log_bytes(log_path, 0, log_end) if log_end else ([], 0)
+    t_parse = time.perf_counter() - t0
+
+    seen = set()
+    untimed, timed = [], []
+    bad = sum(r[2] for r in results) + log_bad
+    errors = {p: e for p, _, _, e in results if e}
+    parsed = len(log_rows) + sum(len(r[1]) for r in results)
+    for rows in [log_rows] + [r[1] for r in results]:
+        _merge_rows(rows, seen, untimed, timed)
+
+    with lock:
+        size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+        same = size >= log_end and _read_tail(log_path, log_end) == log_tail
+        # rows the app appended meanwhile, or the whole log if it was rewritten (SD upload)
+        extra, extra_bad = _parse_log_bytes(log_path, log_end if same else 0, size) if size else ([], 0)
+        parsed += len(extra)
+        bad += extra_bad
+        _merge_rows(extra, seen, untimed, timed)
+        timed.sort(key=lambda r: r[0])
+        stats, weights = usage_stats(untimed + timed)
+
+        old_agg = _read_agg(agg_path) if agg_path else []
+        hw = _agg_high_water(old_agg)
+        covered = {parse_time(row[0]) for row in old_agg}
+        buckets = {}
+        skipped = 0
+        if hw is not None:
+            split = 0
+            while split < len(timed) and timed[split][0] <= hw:
+                split += 1
+            for t, _, _, weight, gasv, status, _ in timed[:split]:
+                if int(t // bucket) * bucket in covered:
+                    skipped += 1  # that hour is already aggregated; can't tell which readings it holds
+                else:
+                    _fold(buckets, bucket, t, weight, gasv, status)
+            timed = timed[split:]
+        merged = untimed + timed
+        out = io.StringIO()
+        w = csv.writer(out)
+        w.writerow(LOG_COLUMNS)
+        for r in merged:
+            w.writerow([r[2], f"{r[3]:.2f}", f"{r[4]:.3f}", r[5], r[1], r[6]])
+        if buckets:
+            _write_agg(agg_path, old_agg, _bucket_rows(buckets))
+        _replace_text(log_path, out.getvalue())
+        if committed:
+            committed(max((r[2] for r in merged), default=0))
+    stats.update({"files": len(paths), "bad_rows": bad, "errors": errors,
+                  "duplicates": parsed - len(seen),
+                  "kept_raw": len(merged), "aggregated": sum(b[0] for b in buckets.values()),
+                  "skipped_aggregated": skipped,
+                  "parse_seconds": t_parse, "seconds": time.perf_counter() - t0})
+    return stats, weights
+
+
+# ---------------- Benchmarks ----------------
+def _sample_log(rows):
+    lines = [",".join(LOG_HEADER)]
+    w = 12.5
+    for i in range(1, rows + 1):
+        w = max(0.0, w - 0.0007)
+        st = "LOW" if w < 2 else "OK"
+        lines.append(f"{i},{w:.2f},{0.3 + (i % 17) * 0.001:.3f},{st}")
+    return "\n".join(lines)
+
+
+def _wire_bytes(lines):
+    return sum(len(l) + 1 for l in lines)
+
+
+def bench_transfer(rows=5000, baud=9600, drop_at=0.5):
+    # Simulated SPP link: 10 bits per byte on the wire (8N1), plus measured decode time.
+    # A dropout at drop_at restarts text mode from scratch; bulk mode resumes.
+    text = _sample_log(rows)
+    bps = baud / 10.0
+    print(f"rows={rows} link={baud} baud (~{bps:.0f} B/s) dropout at {drop_at:.0%}")
+
+    text_lines = ["BEGIN_LOG"] + text.splitlines() + ["END_LOG"]
+    t0 = time.perf_counter()
+    assert "\n".join(text_lines[1:-1]) == text
+    text_cpu = time.perf_counter() - t0
+    text_wire = _wire_bytes(text_lines)
+    text_drop = text_wire + int(text_wire * drop_at)
+    results = [("text", text_wire, text_cpu, text_drop)]
+
+    for codec in BULK_CODECS:
+        frames = bulk_encode(text, codec)
+        rx = BulkReceiver()
+        t0 = time.perf_counter()
+        rx.begin(frames[0])
+        for l in frames[1:-1]:
+            rx.frame(l)
+        out = rx.end(frames[-1])
+        cpu = time.perf_counter() - t0
+        assert out.splitlines() == text.splitlines()
+        wire = _wire_bytes(frames)
+        cut = int((len(frames) - 2) * drop_at)
+        # resend: the chunks after the cut plus one resume handshake
+        resumed = bulk_encode(text, codec, start_seq=cut)
+        drop = _wire_bytes(frames[:cut + 1]) + _wire_bytes(resumed) + len(rx.resume_request()) + 1
+        results.append((f"bulk/{codec}", wire, cpu, drop))
+
+    print(f"{'mode':<12}{'wire B':>10}{'link s':>10}{'cpu ms':>10}{'kB/s':>10}{'w/ drop s':>12}")
+    for name, wire, cpu, drop in results:
+        secs = wire / bps + cpu
+        print(f"{name:<12}{wire:>10}{secs:>10.1f}{cpu * 1000:>10.1f}{len(text) / secs / 1000:>10.2f}{drop / bps + cpu:>12.1f}")
+    return results
+
+
+def bench_import(files=32, rows=20000, workers=None):
+    # Parses the same synthetic archives with 1..N worker processes.
+    import tempfile
+    counts = workers or sorted(n for n in {1, 2, 4, 8, os.cpu_count() or 1} if n <= (os.cpu_count() or 1))
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.time() - files * rows * 60
+        for fi in range(files):
+            with open(os.path.join(tmp, f"archive_{fi:03}.csv"), "w", newline="", encoding="utf-8") as f:
+                w = csv.writer(f)
+                w.writerow(LOG_COLUMNS)
+                for i in range(rows):
+                    t = start + (fi * rows + i) * 60
+                    w.writerow([i + 1, f"{12.5 - (i % 5000) * 0.002:.2f}", "0.300", "OK",
+                                time.strftime(TIME_FMT, time.localtime(t))])
+        print(f"{files} archives x {rows} rows, {os.cpu_count()} cpus")
+        print(f"{'workers':>8}{'parse s':>10}{'total s':>10}{'speedup':>10}")
+        base = None
+        for n in counts:
+            log = os.path.join(tmp, f"merged_{n}.log")
+            stats, _ = import_archives(tmp, log, workers=n)
+            base = base or stats["parse_seconds"]
+            print(f"{n:>8}{stats['parse_seconds']:>10.2f}{stats['seconds']:>10.2f}{base / stats['parse_seconds']:>10.2f}")
+            os.remove(log)
+
+
+# ---------------- CLI ----------------
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="safergas_data", description="Safer Gas data tools")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("bench-transfer", help="compare text and bulk SD transfer on a slow link")
+    b.add_argument("--rows", type=int, default=5000)
+    b.add_argument("--baud", type=int, default=9600)
+    b.add_argument("--drop-at", type=float, default=0.5)
+    c = sub.add_parser("compact", help="fold readings older than the retention window into aggregates")
+    c.add_argument("log", help="path to safergas_logs.csv")
+    c.add_argument("--days", type=int, default=RETENTION_DAYS)
+    c.add_argument("--bucket", type=int, default=AGG_BUCKET, help="aggregate bucket in seconds")
+    i = sub.add_parser("import", help="merge a directory of CSV archives / SD dumps into a log")
+    i.add_argument("src", help="directory (or single file) of archives")
+    i.add_argument("log", help="safergas_logs.csv to merge into (created if missing)")
+    i.add_argument("--workers", type=int, default=None)
+    pa = sub.add_parser("parse", help=argparse.SUPPRESS)  # used by parse_in_subprocess
+    pa.add_argument("paths", help="JSON list of archive paths")
+    pa.add_argument("out", help="JSON file for the parsed rows")
+    pa.add_argument("--workers", type=int, default=None)
+    bi = sub.add_parser("bench-import", help="archive import speedup vs worker processes")
+    bi.add_argument("--files", type=int, default=32)
+    bi.add_argument("--rows", type=int, default=20000)
+    bi.add_argument("--workers", type=int, nargs="*", default=None)
+    args = p.parse_args(argv)
+    if args.cmd == "bench-transfer":
+        bench_transfer(args.rows, args.baud, args.drop_at)
+    elif args.cmd == "compact":
+        migrate_log_header(args.log)
+        agg = os.path.splitext(args.log)[0] + "_agg.csv"
+        total = 0
+        while True:
+            res = compact_log(args.log, agg, args.days, args.bucket)
+            if not res:
+                break
+            total += res["saved"]
+            print(f"folded {res['folded']} rows into {res['buckets']} buckets, "
+                  f"saved {res['saved']} B in {res['seconds']:.2f} s")
+            if not res["more"]:
+                break
+        print(f"total saved {total} B")
+    elif args.cmd == "import":
+        def progress(done, total, path, rows, bad, err):
+            print(f"[{done}/{total}] {os.path.basename(path)}: {err or f'{rows} rows, {bad} bad'}")
+        migrate_log_header(args.log)
+        agg = os.path.splitext(args.log)[0] + "_agg.csv"
+        stats, _ = import_archives(args.src, args.log, agg, args.workers, progress=progress)
+        for k, v in stats.items():
+            print(f"{k}: {v}")
+    elif args.cmd == "parse":
+        def progress(done, total, path, rows, bad, err):
+            print(json.dumps({"done": done, "total": total, "path": path, "rows": rows, "bad": bad, "error": err}),
+                  flush=True)
+        with open(args.paths, "r", encoding="utf-8") as f:
+            paths = json.load(f)
+        results = _parse_all(paths, args.workers, progress)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f)
+    elif args.cmd == "bench-import":
+        bench_import(args.files, args.rows, args.workers)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
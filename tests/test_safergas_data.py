@@ -0,0 +1,283 @@
+import os, sys, csv, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import safergas_data as sd
+
+
+# ---------------- Bulk SD transfer ----------------
+def _frames(rows=500, **kw):
+    text = sd._sample_log(rows)
+    return text, sd.bulk_encode(text, **kw)
+
+
+def _corrupt(frame):
+    head, b64 = frame.rsplit(",", 1)
+    return head + "," + ("B" if b64[0] == "A" else "A") + b64[1:]
+
+
+def test_bulk_roundtrip(tmp_path):
+    text, frames = _frames()
+    rx = sd.BulkReceiver(str(tmp_path / "p.jsonl"))
+    assert rx.begin(frames[0]) is None
+    assert all(rx.frame(l) is None for l in frames[1:-1])
+    assert rx.end(frames[-1]).splitlines() == text.splitlines()
+    assert not os.path.exists(tmp_path / "p.jsonl")
+
+
+def test_bad_crc_asks_resend_once_then_accepts_resent_chunk():
+    text, frames = _frames()
+    rx = sd.BulkReceiver()
+    rx.begin(frames[0])
+    rx.frame(frames[1])
+    assert rx.frame(_corrupt(frames[2])) == 1
+    assert rx.frame(frames[3]) is None  # gap after asking: wait for the device
+    assert rx.next_seq == 1
+    resent = sd.bulk_encode(text, start_seq=1)
+    for l in resent[1:-1]:
+        assert rx.frame(l) is None
+    assert rx.end(resent[-1]).splitlines() == text.splitlines()
+
+
+def test_missing_chunk_and_whole_crc_mismatch():
+    text, frames = _frames()
+    rx = sd.BulkReceiver()
+    rx.begin(frames[0])
+    for l in frames[1:-2]:
+        rx.frame(l)
+    try:
+        rx.end(frames[-1])
+        assert False, "missing chunk accepted"
+    except ValueError:
+        assert rx.active
+    rx.frame(frames[-2])
+    bad_end = frames[-1].rsplit(",", 1)[0] + ",00000000"
+    try:
+        rx.end(bad_end)
+        assert False, "bad whole-file CRC accepted"
+    except ValueError:
+        assert rx.active and rx.next_seq == 0
+
+
+def test_resume_after_dropout_from_partial_file(tmp_path):
+    path = str(tmp_path / "p.jsonl")
+    text, frames = _frames(rows=3000)
+    rx = sd.BulkReceiver(path)
+    rx.begin(frames[0])
+    for l in frames[1:21]:
+        rx.frame(l)
+    # periodic checkpoint already hit the disk before any pause
+    assert sd.BulkReceiver(path).next_seq == sd.BULK_SAVE_EVERY
+    rx.save_partial()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('"torn')  # crash mid-append
+    rx2 = sd.BulkReceiver(path)
+    assert rx2.next_seq == 20
+    assert rx2.resume_request().endswith(f",{rx.session},20")
+    resumed = sd.bulk_encode(text, start_seq=20)
+    assert rx2.begin(resumed[0]) is None
+    for l in resumed[1:-1]:
+        rx2.frame(l)
+    assert rx2.end(resumed[-1]).splitlines() == text.splitlines()
+
+
+def test_new_session_discards_stale_chunks():
+    _, frames = _frames()
+    rx = sd.BulkReceiver()
+    rx.begin(frames[0])
+    rx.frame(frames[1])
+    other = sd.bulk_encode(sd._sample_log(100), session="other")
+    assert rx.begin(other[0]) is None and rx.next_seq == 0
+
+
+def test_malformed_begin_is_rejected_without_activating():
+    rx = sd.BulkReceiver()
+    for line in ["BULK_BEGIN", "BULK_BEGIN,s,zlib,x,0", "BULK_BEGIN,s,lzma,4,0", "BULK_BEGIN,,zlib,4,0"]:
+        try:
+            rx.begin(line)
+            assert False, line
+        except ValueError:
+            assert not rx.active
+    assert sd.BulkReceiver.parse_begin("BULK_BEGIN,s,raw,4,2") == ("s", "raw", 4, 2)
+
+
+# ---------------- Retention / compaction ----------------
+DAY = 86400
+
+
+def _ts(t):
+    return time.strftime(sd.TIME_FMT, time.localtime(t))
+
+
+def _write_log(path, start, rows, step=100, source="sd"):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(sd.LOG_COLUMNS)
+        for i in range(rows):
+            w.writerow([i + 1, f"{10 - i * 0.0001:.2f}", "0.300", "OK", _ts(start + i * step), source])
+
+
+def _agg_samples(agg):
+    rows = sd._read_agg(agg)
+    return sum(int(r[1]) for r in rows), [r[0] for r in rows]
+
+
+def _log_rows(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))[1:]
+
+
+def test_compaction_keeps_one_row_per_bucket_across_capped_passes(tmp_path):
+    log, agg = str(tmp_path / "l.csv"), str(tmp_path / "l_agg.csv")
+    now = time.time()
+    _write_log(log, now - 40 * DAY, 30000)
+    passes = 0
+    while sd.compact_log(log, agg, 30, max_rows=1000, now=now):
+        passes += 1
+    samples, times = _agg_samples(agg)
+    assert passes > 1
+    assert len(times) == len(set(times))
+    cutoff = int((now - 30 * DAY) // sd.AGG_BUCKET) * sd.AGG_BUCKET
+    kept = _log_rows(log)
+    assert all(sd.parse_time(r[4]) >= cutoff for r in kept)
+    assert samples + len(kept) == 30000
+
+
+def test_compaction_keeps_rows_appended_during_pass(tmp_path):
+    log, agg = str(tmp_path / "l.csv"), str(tmp_path / "l_agg.csv")
+    now = time.time()
+    _write_log(log, now - 40 * DAY, 20000)
+
+    class AppendingLock:
+        entered = 0
+
+        def __enter__(self):
+            self.entered += 1
+            if self.entered == 2:  # the app appends while compaction works
+                with open(log, "a", newline="", encoding="utf-8") as f:
+                    csv.writer(f).writerow([20001, "1.00", "0.300", "OK", _ts(now)])
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    assert sd.compact_log(log, agg, 30, lock=AppendingLock(), now=now)
+    assert _log_rows(log)[-1][0] == "20001"
+
+
+def test_crash_between_swaps_does_not_double_count(tmp_path):
+    log, agg = str(tmp_path / "l.csv"), str(tmp_path / "l_agg.csv")
+    now = time.time()
+    _write_log(log, now - 40 * DAY, 20000)
+    with open(log, "rb") as f:
+        before = f.read()
+    sd.compact_log(log, agg, 30, now=now)
+    with open(log, "wb") as f:
+        f.write(before)  # aggregates swapped in, log swap lost
+    sd.compact_log(log, agg, 30, now=now)
+    samples, _ = _agg_samples(agg)
+    assert samples + len(_log_rows(log)) == 20000
+
+
+def test_sd_upload_keeps_times_skips_folded_and_stamps_new(tmp_path):
+    log, agg = str(tmp_path / "l.csv"), str(tmp_path / "l_agg.csv")
+    now = time.time()
+    _write_log(log, now - 40 * DAY, 20000)
+    sd.compact_log(log, agg, 30, now=now)
+    known = {r[0]: r[4] for r in _log_rows(log)}
+    dump = [sd.LOG_HEADER] + [[i + 1, f"{10 - i * 0.0001:.2f}", "0.300", "OK"] for i in range(20010)]
+    res = sd.write_sd_log(log, agg, dump, now=now)
+    rows = _log_rows(log)
+    assert res["stamped"] == 10 and res["aggregated"] == 20000 - len(known)
+    assert all(r[4] == known[r[0]] for r in rows if r[0] in known)
+    assert [r[4] for r in rows[-10:]] == [_ts(now)] * 10
+    # a second upload of the same dump changes nothing
+    sd.write_sd_log(log, agg, dump, now=now + DAY)
+    assert _log_rows(log) == rows
+
+
+def test_sd_upload_from_wiped_device_keeps_every_row(tmp_path):
+    log, agg = str(tmp_path / "l.csv"), str(tmp_path / "l_agg.csv")
+    now = time.time()
+    _write_log(log, now - 40 * DAY, 20000)
+    sd.compact_log(log, agg, 30, now=now)
+    assert sd._agg_anchor(sd._read_agg(agg))[0] > 0
+    # device SD was wiped and has since logged more readings than LastEntry
+    dump = [sd.LOG_HEADER] + [[i + 1, f"{20 - i * 0.0001:.2f}", "0.310", "OK"] for i in range(30000)]
+    res = sd.write_sd_log(log, agg, dump, now=now)
+    assert res["aggregated"] == 0 and res["stamped"] == 30000
+
+
+# ---------------- Archive import ----------------
+def test_import_keeps_rows_appended_while_parsing(tmp_path):
+    arch = tmp_path / "arch"
+    arch.mkdir()
+    now = time.time()
+    _write_log(str(arch / "old.csv"), now - 5 * DAY, 100)
+    log = str(tmp_path / "l.csv")
+    _write_log(log, now - DAY, 10)
+
+    def parser(paths, workers, progress):
+        with open(log, "a", newline="", encoding="utf-8") as f:  # _add_reading during the parse
+            csv.writer(f).writerow([11, "3.00", "0.300", "LOW", _ts(now)])
+        return sd._parse_all(paths, 1, progress)
+
+    stats, _ = sd.import_archives(str(arch), log, parser=parser)
+    rows = _log_rows(log)
+    assert stats["readings"] == 111 and len(rows) == 111
+    assert rows[-1][:5] == ["11", "3.00", "0.300", "LOW", _ts(now)]
+
+
+def test_import_skips_unreadable_files_and_dedups(tmp_path):
+    arch = tmp_path / "arch"
+    arch.mkdir()
+    now = time.time()
+    _write_log(str(arch / "a.csv"), now - 5 * DAY, 100)
+    _write_log(str(arch / "b.csv"), now - 5 * DAY, 150)  # first 100 rows repeat a.csv
+    (arch / "notes.txt").write_text("x" * 200000)
+    (arch / "other.csv").write_text("foo,bar\n1,2\n")
+    log = str(tmp_path / "l.csv")
+    seen = []
+    stats, _ = sd.import_archives(str(arch), log, workers=1, progress=lambda *a: seen.append(a))
+    assert len(seen) == 4
+    assert set(os.path.basename(p) for p in stats["errors"]) == {"notes.txt", "other.csv"}
+    assert stats["duplicates"] == 100 and len(_log_rows(log)) == 150
+    times = [sd.parse_time(r[4]) for r in _log_rows(log)]
+    assert times == sorted(times)
+
+
+def test_imported_rows_survive_sd_upload_and_keep_identity(tmp_path):
+    arch = tmp_path / "arch"
+    arch.mkdir()
+    now = time.time()
+    _write_log(str(arch / "old.csv"), now - 5 * DAY, 100, source="")
+    log, agg = str(tmp_path / "l.csv"), str(tmp_path / "l_agg.csv")
+    stats, _ = sd.import_archives(str(arch), log, agg, workers=1)
+    imported = _log_rows(log)
+    assert [r[0] for r in imported] == [str(i + 1) for i in range(100)]
+    assert {r[5] for r in imported} == {"import"}
+    # the device still holds the first 20 of those readings plus 5 new ones
+    dump = [sd.LOG_HEADER] + [[i + 1, f"{10 - i * 0.0001:.2f}", "0.300", "OK"] for i in range(20)]
+    dump += [[200 + i, "4.00", "0.300", "OK"] for i in range(5)]
+    res = sd.write_sd_log(log, agg, dump, now=now)
+    rows = _log_rows(log)
+    assert res["added"] == 5 and res["max_entry"] == 204 and len(rows) == 105
+    assert rows[:100] == imported  # times and sources of the imported rows are untouched
+    assert [r[4] for r in rows[100:]] == [_ts(now)] * 5
+
+
+def test_import_reports_rows_in_aggregated_hours(tmp_path):
+    arch = tmp_path / "arch"
+    arch.mkdir()
+    now = time.time()
+    log, agg = str(tmp_path / "l.csv"), str(tmp_path / "l_agg.csv")
+    start = int((now - 40 * DAY) // sd.AGG_BUCKET) * sd.AGG_BUCKET
+    _write_log(log, start, 100, step=60)
+    sd.compact_log(log, agg, 30, now=now)
+    samples, _ = _agg_samples(agg)
+    # archive repeats the same two hours plus one older, uncovered hour
+    _write_log(str(arch / "a.csv"), start - 7200, 120 + 100, step=60)
+    stats, _ = sd.import_archives(str(arch), log, agg, workers=1)
+    assert stats["skipped_aggregated"] == 100
+    assert stats["aggregated"] == 120
+    assert _agg_samples(agg)[0] == samples + 120